@@ -8,6 +8,7 @@ import re
 from textwrap import dedent
 from collections import deque
 import functools
+import sys
 from heapq import heappush, heappop
 import warnings
 import weakref
@@ -110,12 +111,27 @@ class Field(object):
         makedict('group', 3),
         makedict('fixed32,sfixed32,float', 5),
         )
+    ARRAY_TYPES = frozenset((
+        'int32,int64,uint32,uint64,sint32,sint64,bool,'
+        'fixed32,sfixed32,fixed64,sfixed64,float,double').split(','))
+    VIEW_TYPES = frozenset(
+        'fixed32,sfixed32,fixed64,sfixed64,float,double'.split(','))
+    CTYPES = mergedicts(
+        makedict('int32,sint32,sfixed32', 'int32_t'),
+        makedict('uint32,fixed32', 'uint32_t'),
+        makedict('int64,sint64,sfixed64', 'int64_t'),
+        makedict('uint64,fixed64', 'uint64_t'),
+        makedict('bool', 'bint'),
+        makedict('float', 'float'),
+        makedict('double', 'double'),
+        )
     def __init__(self, index, name, type, options):
         self.index = int(index)
         self.name = name
         self.type = type
         self.options = options
     def set(self, where):
+        self.location = weakref.ref(where)
         where.set_field(self)
     def get_tag(self, state):
         tag = self.TYPE_TAG.get(self.type)
@@ -130,23 +146,118 @@ class Field(object):
         else:
             decoder_name = state.find_name(self.type).fullname
 
-        if self.kind == 'repeated' and self.is_packed(state):
+        if self.is_view(state):
+            return 'view_deserialize_' + decoder_name
+        elif self.is_array(state):
+            return 'array_deserialize_' + decoder_name
+        elif self.kind == 'repeated' and self.is_packed(state):
             return 'repeat_deserialize_' + decoder_name
+        elif self.is_lazy(state):
+            return 'deserialize_bytes'
         else:
             return 'deserialize_' + decoder_name
 
+    def get_serializer_name(self, state):
+        if self.type in self.TYPE_TAG:
+            return 'serialize_' + self.type
+        target = state.find_name(self.type)
+        if target.tag == 'enum':
+            return 'serialize_int32'
+        if target.tag == 'group':
+            return 'serialize_' + target.fullname
+        return 'serialize_with_length_' + target.fullname
+
+    def get_bytesize_name(self, state):
+        if self.type in self.TYPE_TAG:
+            return 'bytesize_' + self.type
+        target = state.find_name(self.type)
+        if target.tag == 'enum':
+            return 'bytesize_int32'
+        if target.tag == 'group':
+            return 'bytesize_' + target.fullname
+        return 'bytesize_with_length_' + target.fullname
+
     def get_special_options(self, state):
         number = 0
         if self.kind == 'repeated' and not self.is_packed(state):
             number |= 1
+        if self.is_lazy(state):
+            number |= 2
+        if self.kind == 'repeated' and self.is_packed(state):
+            number |= 4
         return number
 
     def get_default_value(self, state):
-        return self.options.get('default', None)
+        default = self.options.get('default', None)
+        if default is not None and self.is_enum(state):
+            target = state.find_name(self.type)
+            target.get_value(default)
+            return '{0}.{1}'.format(target.fullname, default)
+        return default
+
+    def get_option(self, state, name, default=None):
+        'Search option in field, then in its message, outer messages and protocol'
+        if name in self.options:
+            return self.options[name]
+        return self.location().get_property(name, default)
 
     def is_packed(self, state):
         return self.options.get('packed', False)
 
+    def can_be_packed(self, state):
+        'Repeated scalar and enumeration fields may come packed on wire'
+        return self.kind == 'repeated' and self.get_tag(state) in (0, 1, 5)
+
+    def is_message(self, state):
+        'Field holds nested message or group'
+        if self.type in self.TYPE_TAG:
+            return False
+        return state.find_name(self.type).tag in ('message', 'group')
+
+    def is_enum(self, state):
+        'Field holds value of enumeration'
+        if self.type in self.TYPE_TAG:
+            return False
+        return state.find_name(self.type).tag == 'enum'
+
+    def is_array(self, state):
+        'Packed numeric fields could be decoded into array.array'
+        if self.kind != 'repeated' or self.type not in self.ARRAY_TYPES:
+            return False
+        if not self.is_packed(state):
+            return False
+        return bool(self.get_option(state, 'array', False))
+
+    def is_view(self, state):
+        'Packed fixed-width fields could be exposed as views on input'
+        if self.kind != 'repeated' or self.type not in self.VIEW_TYPES:
+            return False
+        if not self.is_packed(state) or self.location().in_debug(state):
+            return False
+        return bool(self.get_option(state, 'view', False))
+
+    def get_empty_value(self, state):
+        'Python expression for initial value of repeated field'
+        if self.is_array(state) or self.is_view(state):
+            return 'new_array(__array_{0})'.format(self.type)
+        return '[]'
+
+    def get_ctype(self, state):
+        'C type of attribute holding field value in extension types'
+        if self.kind == 'repeated' or self.is_lazy(state):
+            return 'object'
+        return self.CTYPES.get(self.type, 'object')
+
+    def is_lazy(self, state):
+        'Singular message fields could be decoded on first access'
+        if self.kind == 'repeated' or self.type in self.TYPE_TAG:
+            return False
+        if self.location().in_debug(state):
+            return False
+        if state.find_name(self.type).tag != 'message':
+            return False
+        return bool(self.get_option(state, 'lazy', False))
+
     def pretty(self, state):
         tag = self.TYPE_TAG.get(self.type)
         if tag is None:
@@ -155,15 +266,6 @@ class Field(object):
             tag=tag,
             **self.__dict__)
 
-class Enum(object):
-    tag = 'enum'
-    def __init__(self, name):
-        self.name = name
-    def set(self, where):
-        where.set_enum(self)
-    def pretty(self, state):
-        yield 'Enum: {name}'.format(**self.__dict__)
-
 class Part(object):
     '''
     Basic renderable type
@@ -186,8 +288,66 @@ class Part(object):
             this=self,
             state=state,
             functools=functools,
+            sys=sys,
             **builtins.__dict__)
 
+    def in_debug(self, state):
+        try:
+            return state.protocol.properties.debug
+        except AttributeError:
+            return False
+
+class Enum(Part):
+    '''
+    Represents enumeration with its values
+    '''
+    template = ENVIRONMENT.get_template('enum.pytempl')
+    tag = 'enum'
+    location = lambda : None
+    # lookup table is used while values are not spread much wider
+    DENSITY = 4
+    def __init__(self, name, values, options):
+        self.name = name
+        self.values = values
+        self.options = options
+
+    def set(self, where):
+        self.location = weakref.ref(where)
+        where.set_enum(self)
+
+    @property
+    def fullname(self):
+        names = [self.name]
+        scope = self.location()
+        while isinstance(scope, Message):
+            names.append(scope.name)
+            scope = scope.location()
+        return '_'.join(reversed(names))
+
+    def is_nested(self):
+        'Enumeration is declared inside of message'
+        return isinstance(self.location(), Message)
+
+    def get_value(self, name):
+        'Number of value with given name'
+        for value_name, number in self.values:
+            if value_name == name:
+                return number
+        raise NameError('{0} is not a value of enum {1}'.format(name, self.name))
+
+    def get_table_range(self):
+        'Bounds of lookup table of members or None if values are too sparse'
+        numbers = [number for name, number in self.values]
+        if not numbers:
+            return None
+        low, high = min(numbers), max(numbers)
+        if high - low >= self.DENSITY * len(numbers) + 16:
+            return None
+        return low, high
+
+    def pretty(self, state):
+        yield 'Enum: {name}'.format(**self.__dict__)
+
 class Extension(object):
     def __init__(self, start, end=None):
         self.start = start
@@ -230,12 +390,6 @@ class Compound(Part):
     def warn(self, *args):
         warnings.warn(*args)
 
-    def in_debug(self, state):
-        try:
-            return state.protocol.properties.debug
-        except AttributeError:
-            return False
-
     def pretty(self, state):
         for name, message in self.messages.items():
             for part in message.pretty(state):
@@ -272,6 +426,203 @@ class Message(Compound):
             return self._fullname
         return self.name
 
+    def get_lazy_fields(self, state):
+        return [self.fields_by_index[index]
+            for index in sorted(self.fields_by_index)
+            if self.fields_by_index[index].is_lazy(state)]
+
+    def get_unpacked_fields(self, state):
+        return [self.fields_by_index[index]
+            for index in sorted(self.fields_by_index)
+            if self.fields_by_index[index].kind == 'repeated'
+            and not self.fields_by_index[index].is_packed(state)]
+
+    def get_group_fields(self, state):
+        return [self.fields_by_index[index]
+            for index in sorted(self.fields_by_index)
+            if self.fields_by_index[index].get_tag(state) == 3]
+
+    def get_property(self, name, default=None):
+        'Search option in message, then in outer messages and protocol'
+        scope = self
+        while scope is not None:
+            if name in scope.properties:
+                return scope.properties[name]
+            scope = getattr(scope, 'location', lambda: None)()
+        return default
+
+    def get_attribute_names(self):
+        'Names of instance attributes holding values of fields and caches'
+        names = tuple(self.fields_by_index[index].name[0].lower()
+            + self.fields_by_index[index].name[1:]
+            for index in sorted(self.fields_by_index))
+        return names + ('_cached_size_', '_unknown_', '_lazy_')
+
+    def get_slot_names(self, state):
+        'Contents of __slots__ of generated python class'
+        names = tuple(self.fields_by_name) + ('_cached_size_', '_unknown_')
+        if not self.is_extension_type(state):
+            names += ('_has_',)
+        if self.get_lazy_fields(state):
+            names += ('_lazy_',)
+        if self.is_immutable(state):
+            names += ('_frozen_', '_hash_', '_encoded_')
+        elif self.tracks_changes(state):
+            names += ('_encoded_', '_parents_')
+        return names
+
+    def get_cache_slot_names(self, state):
+        'Slots of generated python class which are not holding field values'
+        return tuple(name for name in self.get_slot_names(state)
+            if name.startswith('_') and name != '_has_')
+
+    def get_pool_size(self, state):
+        '''
+        Limit of free list for released instances, 0 if pooling is off.
+        Releasing instance consumes all nested messages of pooled types,
+        including ones still referred to by other messages.
+        '''
+        if self.is_immutable(state):
+            return 0
+        return int(self.get_property('pool', 0))
+
+    def is_immutable(self, state):
+        'Instances are frozen after construction or decoding'
+        if not self.get_property('immutable', False):
+            return False
+        for index in sorted(self.fields_by_index):
+            field = self.fields_by_index[index]
+            if field.is_array(state) or field.is_view(state):
+                raise ValueError(
+                    'Field {0} of immutable message {1} can not be decoded '
+                    'into array or view, they are changed in place'.format(
+                        field.name, self.name))
+        return True
+
+    def tracks_changes(self, state):
+        '''
+        Instances report changes of fields to drop their cached encoding.
+        Lists assigned to repeated fields are copied into tracked lists, so
+        later changes of the original list are not seen by the message.
+        '''
+        if self.is_immutable(state):
+            return False
+        return bool(self.get_property('track_changes', False))
+
+    def overrides_setattr(self, state):
+        'Generated python class intercepts assignment of attributes'
+        return not self.is_extension_type(state)
+
+    def caches_encoding(self, state):
+        'Encoding of instance can be kept as no nested message changes unseen'
+        seen = set()
+        pending = [self]
+        while pending:
+            message = pending.pop()
+            if id(message) in seen:
+                continue
+            seen.add(id(message))
+            if message.is_immutable(state):
+                pass
+            elif not message.tracks_changes(state):
+                return False
+            elif any(field.is_array(state) or field.is_view(state)
+                    for field in message.fields_by_index.values()):
+                return False # arrays are changed in place unnoticed
+            for field in message.fields_by_index.values():
+                if field.is_message(state):
+                    pending.append(state.find_name(field.type))
+        return True
+
+    def get_list_fields(self, state):
+        'Repeated fields holding values in plain lists'
+        return [self.fields_by_index[index]
+            for index in sorted(self.fields_by_index)
+            if self.fields_by_index[index].kind == 'repeated'
+            and self.fields_by_index[index].get_empty_value(state) == '[]']
+
+    def get_tracked_fields(self, state):
+        'Fields holding nested messages which report their changes'
+        return [self.fields_by_index[index]
+            for index in sorted(self.fields_by_index)
+            if self.fields_by_index[index].is_message(state)
+            and state.find_name(self.fields_by_index[index].type).tracks_changes(state)]
+
+    def is_extension_type(self, state):
+        'Message is generated as cdef class with typed attributes'
+        return bool(self.get_property('cdef_class', False))
+
+    def get_presence_words(self):
+        'Size of bitmap telling which fields are set'
+        return max(1, (len(self.fields_by_index) + 31) // 32)
+
+    def get_presence_bit(self, field):
+        'Position of bit of field in presence bitmap'
+        return sorted(self.fields_by_index).index(field.index)
+
+    def get_presence_mask(self, fields):
+        'Presence bitmap of python class with bits of given fields set'
+        mask = 0
+        for field in fields:
+            mask |= 1 << self.get_presence_bit(field)
+        return mask
+
+    def get_presence_test(self, field, owner):
+        'Expression telling whether field of extension type is set'
+        bit = self.get_presence_bit(field)
+        return '{0}._has_[{1}] & 0x{2:x}'.format(owner, bit >> 5, 1 << (bit & 31))
+
+    def get_presence_change(self, field, owner, present):
+        'Statement marking field of extension type as set or not set'
+        bit = self.get_presence_bit(field)
+        return '{0}._has_[{1}] {2} 0x{3:x}'.format(
+            owner, bit >> 5, '|=' if present else '&= ~', 1 << (bit & 31))
+
+    def get_value(self, state, field, owner='self'):
+        'Expression reading value of field from self'
+        name = field.name[0].lower()+field.name[1:]
+        if self.is_extension_type(state) and not field.is_lazy(state):
+            return '(<{0}>{1})._f_{2}'.format(self.fullname, owner, name)
+        return '{0}.{1}'.format(owner, name)
+
+    def get_presence(self, state, field):
+        'Expression telling whether optional field of self has to be encoded'
+        name = field.name[0].lower()+field.name[1:]
+        default = field.get_default_value(state)
+        if field.is_lazy(state):
+            return 'getattr(self, "{0}", {1}) != {1}'.format(name, default)
+        if not self.is_extension_type(state):
+            return 'self._has_ & 0x{0:x}'.format(self.get_presence_mask([field]))
+        return self.get_presence_test(field, '(<{0}>self)'.format(self.fullname))
+
+    def get_assignment(self, state, field, value):
+        'Statement storing value into field of self'
+        if not self.is_extension_type(state) or field.is_lazy(state):
+            return 'self.{0} = {1}'.format(field.name[0].lower()+field.name[1:], value)
+        return '{0} = {1}; {2}'.format(
+            self.get_value(state, field), value, self.get_presence_change(
+                field, '(<{0}>self)'.format(self.fullname), True))
+
+    def get_init_assignment(self, state, field, value):
+        'Statement storing argument of constructor into field of self'
+        name = field.name[0].lower()+field.name[1:]
+        if self.is_extension_type(state):
+            return 'self.{0} = {1}'.format(name, value)
+        if self.tracks_changes(state) and field in self.get_list_fields(state):
+            value = 'track_list(self, {0})'.format(value)
+        return 'PyObject_GenericSetAttr(self, "{0}", {1})'.format(name, value)
+
+    def get_presence_names(self):
+        'Mapping of names of fields to their bits in presence bitmap'
+        return dict((field.name[0].lower()+field.name[1:], self.get_presence_bit(field))
+            for field in self.fields_by_index.values())
+
+    def get_pooled_fields(self, state):
+        return [self.fields_by_index[index]
+            for index in sorted(self.fields_by_index)
+            if self.fields_by_index[index].is_message(state)
+            and state.find_name(self.fields_by_index[index].type).get_pool_size(state)]
+
     def set_field(self, field):
         heappush(getattr(self, 'fields_'+field.kind), (field.index, field))
         self.max_index = max(self.max_index, field.index)
@@ -304,6 +655,7 @@ class Message(Compound):
             this=self,
             state=state,
             functools=functools,
+            sys=sys,
             **builtins.__dict__)
         state.pop_ns()
         return result
@@ -360,12 +712,19 @@ class Group(Message):
     def get_tag(self, state):
         return 3
 
+    def get_serializer_name(self, state):
+        return 'serialize_' + state.find_name(self.type).fullname
+
+    def get_bytesize_name(self, state):
+        return 'bytesize_' + state.find_name(self.type).fullname
+
     def render_structure(self, state):
         state.push_ns(self.name)  # add index here?
         result = self.structure.render(
             this=self,
             state=state,
             functools=functools,
+            sys=sys,
             **builtins.__dict__)
         state.pop_ns()
         return result
@@ -378,6 +737,24 @@ class Group(Message):
     def is_packed(self, state):
         return False
 
+    def is_lazy(self, state):
+        return False
+
+    def is_message(self, state):
+        return True
+
+    def is_array(self, state):
+        return False
+
+    def is_view(self, state):
+        return False
+
+    def get_empty_value(self, state):
+        return '[]'
+
+    def get_ctype(self, state):
+        return 'object'
+
     def get_special_options(self, state):
         number = 0
         if self.kind == 'repeated' and not self.is_packed(state):
@@ -420,6 +797,16 @@ class Protocol(Compound):
         yield 'Protocol: {properties!r}'.format(**self.__dict__)
         for part in super(Protocol, self).pretty(state):
             yield part
+    def tracks_changes(self, state):
+        'Some message of file reports changes of its fields'
+        pending = list(self.messages.values())
+        while pending:
+            message = pending.pop()
+            if message.tracks_changes(state):
+                return True
+            pending.extend(message.messages.values())
+        return False
+
     def data(self):
         state = State(self)
         return self.render(state)
@@ -429,7 +816,7 @@ class Protocol(Compound):
         self.imported_protocols[filename] = proto
         for name in proto.messages_order:
             self.set_message(proto.messages[name])
-        for name, enum in self.enums:
+        for name, enum in proto.enums.items():
             self.set_enum(enum)
     def find_name(self, *name):
         parts = deque(name)
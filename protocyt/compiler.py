@@ -187,8 +187,21 @@ class CodeGenerator(TreeVisitor):
         '''
         enum: "enum" indent "{" ( option | enumField | ";" )* "}"
         '''
-        name, _ = itail(self.visit(*node.children))
-        yield classes.Enum(name)
+        name, children = itail(self.visit(*node.children))
+        values, options = [], {}
+        for child in children:
+            if isinstance(child, classes.Property):
+                options['.'.join(child.path)] = child.value
+            else:
+                values.append(child)
+        yield classes.Enum(name, values, options)
+
+    def on_enumField(self, node):
+        '''
+        enumField: indent "=" intlit ";"
+        '''
+        name, value = self.visit(*node.children)
+        yield name, value
 
     def on_message(self, node):
         '''
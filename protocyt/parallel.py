@@ -0,0 +1,78 @@
+'''
+Decoding of large files of length delimited messages in worker processes.
+'''
+
+# standart
+import os
+import mmap
+import functools
+import multiprocessing
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+__all__ = [
+    'map_delimited',
+    'reduce_delimited',
+    ]
+
+def read_range(filename, start, stop):
+    '''
+    Maps file into memory and returns its part without copying. Python 2
+    mappings do not support new buffer protocol, so they are wrapped into
+    old style buffer objects which do and still share the mapped memory.
+    '''
+    with open(filename, 'rb') as stream:
+        mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return memoryview(mapping)[start:stop]
+    except TypeError:
+        return buffer(mapping, start, stop - start)
+
+def decode_range(task):
+    'Worker side: decodes frames of single range and applies func to them'
+    cls, func, filename, start, stop = task
+    return func(cls.iter_delimited(read_range(filename, start, stop)))
+
+def map_delimited(cls, filename, func=list, workers=None, parts=None):
+    '''
+    Decodes file of length delimited messages of given class in worker
+    processes. The file is split on frame boundaries into parts, workers
+    map it into memory, decode their ranges and apply func to iterator
+    over decoded messages. Results are yielded in file order.
+
+    Message class, func and its results are passed between processes so
+    they have to be picklable. Workers use ProcessPoolExecutor, or
+    multiprocessing.Pool where concurrent.futures is not available.
+    '''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if parts is None:
+        parts = workers * 4
+    size = os.path.getsize(filename)
+    if not size:
+        return
+    bounds = cls.frame_boundaries(read_range(filename, 0, size), parts)
+    tasks = [(cls, func, filename, start, stop)
+        for start, stop in zip(bounds, bounds[1:])]
+    if ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(workers) as pool:
+            for result in pool.map(decode_range, tasks):
+                yield result
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for result in pool.imap(decode_range, tasks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+def reduce_delimited(cls, filename, func, combine, initial, **options):
+    '''
+    Same as map_delimited but combines results of parts in file order
+    starting from initial value.
+    '''
+    return functools.reduce(
+        combine, map_delimited(cls, filename, func, **options), initial)
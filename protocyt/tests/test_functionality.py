@@ -1,12 +1,23 @@
 # standart
+import sys
 import unittest
 import inspect
+import array
+import io
+import os
+import operator
+import copy
+import pickle
+import tempfile
 # internal
-from protocyt import meta, protoc, classes
+from protocyt import meta, protoc, classes, parallel
 
 def make_hex(string):
     return ' '.join('%02X' % i for i in string)
 
+def collect_values(messages):
+    return [item.a for item in messages]
+
 class Class1(meta.ProtocoledClass):
     '''
     message Class1 {
@@ -56,6 +67,181 @@ class Class5(meta.ProtocoledClass):
     }
     '''
 
+class Class6(meta.ProtocoledClass):
+    '''
+    message Class6 {
+      message Body {
+        required int32 a = 1;
+      }
+      required int32 id = 1;
+      required Body body = 2 [lazy=true];
+      optional Body extra = 3 [lazy=true];
+    }
+    '''
+
+
+class Class7(meta.ProtocoledClass):
+    '''
+    message Class7 {
+      repeated double d = 1 [packed=true, array=true];
+      repeated sint64 s = 2 [packed=true, array=true];
+      repeated fixed32 f = 3 [packed=true, array=true];
+      repeated int32 i = 4 [packed=true, array=true];
+    }
+    '''
+
+class Class8(meta.ProtocoledClass):
+    '''
+    message Class8 {
+      repeated double d = 1 [packed=true, view=true];
+      repeated sfixed32 s = 2 [packed=true, view=true];
+    }
+    '''
+
+class Class9(meta.ProtocoledClass):
+    '''
+    message Class9 {
+      option pool = 4;
+      message Leaf {
+        required int32 a = 1;
+      }
+      required Leaf leaf = 1;
+      repeated Leaf leaves = 2;
+    }
+    '''
+
+class Class10(meta.ProtocoledClass):
+    '''
+    message Class10 {
+      option cdef_class = true;
+      message Leaf {
+        required int32 a = 1;
+      }
+      required sint64 id = 1;
+      optional double ratio = 2 [default = 1.5];
+      optional bool flag = 3;
+      optional string name = 4;
+      repeated Leaf leaves = 5;
+      repeated uint32 counts = 6 [packed=true];
+      optional Leaf extra = 7 [lazy=true];
+    }
+    '''
+
+class Class11(meta.ProtocoledClass):
+    '''
+    message Class11 {
+      option immutable = true;
+      message Point {
+        required int32 x = 1;
+        optional int32 y = 2 [default = 3];
+      }
+      required string name = 1;
+      repeated Point points = 2;
+      repeated int32 tags = 3 [packed=true];
+      optional Point origin = 4;
+    }
+    '''
+
+class Class12(meta.ProtocoledClass):
+    '''
+    message Class12 {
+      option immutable = true;
+      option cdef_class = true;
+      required int64 id = 1;
+      repeated string names = 2;
+    }
+    '''
+
+class Class13(meta.ProtocoledClass):
+    '''
+    message Class13 {
+      option track_changes = true;
+      message Leaf {
+        required int32 a = 1;
+        repeated int32 values = 2;
+      }
+      required Leaf leaf = 1;
+      repeated Leaf leaves = 2;
+      optional string name = 3;
+    }
+    '''
+
+class Class14(meta.ProtocoledClass):
+    '''
+    message Class14 {
+      option track_changes = true;
+      option cdef_class = true;
+      message Leaf {
+        required int32 a = 1;
+      }
+      required Leaf leaf = 1;
+      repeated Leaf leaves = 2;
+      repeated sint32 values = 3 [packed=true];
+    }
+    '''
+
+class Class15(meta.ProtocoledClass):
+    '''
+    message Class15 {
+      option cdef_class = true;
+      optional int32 f1 = 1 [default = 1];
+      optional int32 f2 = 2 [default = 2];
+      optional int32 f3 = 3 [default = 3];
+      optional int32 f4 = 4 [default = 4];
+      optional int32 f5 = 5 [default = 5];
+      optional int32 f6 = 6 [default = 6];
+      optional int32 f7 = 7 [default = 7];
+      optional int32 f8 = 8 [default = 8];
+      optional int32 f9 = 9 [default = 9];
+      optional int32 f10 = 10 [default = 10];
+      optional int32 f11 = 11 [default = 11];
+      optional int32 f12 = 12 [default = 12];
+      optional int32 f13 = 13 [default = 13];
+      optional int32 f14 = 14 [default = 14];
+      optional int32 f15 = 15 [default = 15];
+      optional int32 f16 = 16 [default = 16];
+      optional int32 f17 = 17 [default = 17];
+      optional int32 f18 = 18 [default = 18];
+      optional int32 f19 = 19 [default = 19];
+      optional int32 f20 = 20 [default = 20];
+      optional int32 f21 = 21 [default = 21];
+      optional int32 f22 = 22 [default = 22];
+      optional int32 f23 = 23 [default = 23];
+      optional int32 f24 = 24 [default = 24];
+      optional int32 f25 = 25 [default = 25];
+      optional int32 f26 = 26 [default = 26];
+      optional int32 f27 = 27 [default = 27];
+      optional int32 f28 = 28 [default = 28];
+      optional int32 f29 = 29 [default = 29];
+      optional int32 f30 = 30 [default = 30];
+      optional int32 f31 = 31 [default = 31];
+      optional int32 f32 = 32 [default = 32];
+      optional int32 f33 = 33 [default = 33];
+      optional int32 f34 = 34 [default = 34];
+      optional string name = 35;
+    }
+    '''
+
+class Class16(meta.ProtocoledClass):
+    '''
+    enum Level {
+      LOW = 1;
+      HIGH = 2;
+    }
+    message Class16 {
+      enum Kind {
+        option allow_alias = true;
+        SMALL = -1;
+        LARGE = 7;
+        BIG = 7;
+        HUGE = 1000000;
+      }
+      required Level level = 1;
+      optional Kind kind = 2 [default = LARGE];
+      repeated Level levels = 3 [packed=true];
+      repeated Kind kinds = 4;
+    }
+    '''
 
 class FunctionalityTest(unittest.TestCase):
     def test_01(self):
@@ -104,6 +290,13 @@ class FunctionalityTest(unittest.TestCase):
         ba = bytearray()
         instance.serialize(ba)
         self.assertEqual(make_hex(ba), '22 06 03 8E 02 9E A7 05')
+        for count, prefix in ((0, '00'), (127, '7F'), (128, '80 01'), (20000, 'E0 D3 02')):
+            for values in (list(range(count)), array.array('i', range(count))):
+                ba = bytearray(b'\x01')
+                Class4(values).serialize(ba)
+                self.assertEqual(make_hex(ba[:len(prefix) // 3 + 3]), '01 22 ' + prefix)
+                self.assertEqual(len(ba) - 1, Class4(values).ByteSize())
+                self.assertEqual(list(Class4.loads(ba, 1).d), list(values))
         self.assertEqual(instance.Extensions['d'], instance.d)
         self.assertEqual(instance.Extensions.d, instance.d)
 
@@ -157,3 +350,534 @@ class FunctionalityTest(unittest.TestCase):
             }
             '''))
         list(protocol.pretty(classes.State(protocol)))
+
+    def test_16(self):
+        'ByteSize'
+        instance = Class3(Class3.Class1(150))
+        self.assertEqual(instance.ByteSize(), 5)
+        self.assertEqual(instance.c.ByteSize(), 3)
+        self.assertEqual(Class4([3, 270, 86942]).ByteSize(), 8)
+
+    def test_17(self):
+        'output appended to bytearray'
+        ba = bytearray(b'\x01\x02')
+        Class3(Class3.Class1(150)).serialize(ba)
+        self.assertEqual(make_hex(ba), '01 02 1A 03 08 96 01')
+        self.assertEqual(make_hex(Class3(Class3.Class1(150)).dumps()),
+            '1A 03 08 96 01')
+
+    def test_18(self):
+        'output requires bytearray'
+        self.assertRaises(TypeError, Class1(150).serialize, [])
+        self.assertRaises(TypeError, Class1(150).serialize, b'')
+
+    def test_19(self):
+        'input from buffer objects'
+        data = b'\x00\x08\x96\x01\x00'
+        self.assertEqual(Class1.loads(data, offset=1, length=3).a, 150)
+        self.assertEqual(Class1.loads(bytearray(data), 1, 3).a, 150)
+        self.assertEqual(Class1.loads(memoryview(data)[1:4]).a, 150)
+        self.assertEqual(Class1.deserialize(data[1:4]).a, 150)
+        self.assertRaises(ValueError, Class1.loads, data, offset=6)
+        self.assertRaises(ValueError, Class1.loads, data, offset=1, length=5)
+        self.assertRaises(ValueError, Class1.loads, data, length=-1)
+
+    def test_20(self):
+        'lazy fields'
+        data = bytes(Class6(1, Class6.Body(150)).dumps())
+        instance = Class6.loads(data)
+        self.assertEqual(instance.id, 1)
+        self.assertTrue(instance.HasField('body'))
+        self.assertFalse(instance.HasField('extra'))
+        self.assertEqual(bytes(instance.dumps()), data)
+        self.assertEqual(instance.body.a, 150)
+        self.assertFalse(instance._lazy_)
+        self.assertEqual(instance, Class6(1, Class6.Body(150)))
+        self.assertRaises(AttributeError, getattr, instance, 'extra')
+
+    def test_21(self):
+        'lazy fields replaced before access'
+        instance = Class6.loads(Class6(1, Class6.Body(150)).dumps())
+        instance.body = Class6.Body(120)
+        self.assertEqual(make_hex(instance.dumps()), '08 01 12 02 08 78')
+        instance.ClearField('body')
+        self.assertFalse(instance.HasField('body'))
+
+    def test_22(self):
+        'varint boundaries'
+        self.assertEqual(Class1.loads(b'\x08\x80\x80\x80\x80\x08').a, -2**31)
+        self.assertEqual(Class1.loads(b'\x08' + b'\xff'*9 + b'\x01').a, -1)
+        self.assertEqual(Class1.loads(b'\x08\xff\x7f').a, 2**14-1)
+        self.assertRaises(Class1.DecodeError,
+            Class1.loads, b'\x08' + b'\xff'*10 + b'\x01')
+        self.assertRaises(Class1.DecodeError, Class1.loads, b'\x08\x96')
+        self.assertRaises(Class1.DecodeError, Class1.loads, b'\x08\x96\x96')
+
+    def test_23(self):
+        'packed fields decoded into arrays'
+        source = Class7([0.5, -2.0], [-1, 2**40, 0], [7, 2**32-1], [-3, 300])
+        instance = Class7.loads(source.dumps())
+        for name in ('d', 's', 'f', 'i'):
+            self.assertTrue(isinstance(getattr(instance, name), array.array))
+            self.assertEqual(list(getattr(instance, name)),
+                list(getattr(source, name)))
+        self.assertEqual(instance.dumps(), source.dumps())
+        empty = Class7.loads(b'')
+        self.assertTrue(isinstance(empty.d, array.array))
+        self.assertEqual(len(empty.d), 0)
+        self.assertRaises(Class7.DecodeError, Class7.loads, b'\x0A\x03\x00\x00\x00')
+        self.assertRaises(Class7.DecodeError, Class7.loads, b'\x22\x02\x01\x96')
+
+    def test_24(self):
+        'packed fields encoded from arrays'
+        source = Class7([0.5, -2.0], [-1, 2**40, 0], [7, 2**32-1], [-3, 300])
+        instance = Class7.loads(source.dumps())
+        instance.d = array.array('d', instance.d)
+        instance.i = array.array('i', [-3, 300])
+        self.assertEqual(instance.dumps(), source.dumps())
+        self.assertEqual(instance.ByteSize(), source.ByteSize())
+        # item type mismatch falls back to per item encoding
+        instance.d = array.array('f', [0.5, -2.0])
+        instance.f = array.array('b', [7])
+        source.f = [7]
+        self.assertEqual(instance.dumps(), source.dumps())
+        self.assertEqual(make_hex(Class4(array.array('i', [3, 270])).dumps()),
+            '22 03 03 8E 02')
+
+    def test_25(self):
+        'packed fixed-width fields exposed as views'
+        source = Class8([0.5, -2.0, 3.0], [-1, 7])
+        data = bytes(source.dumps())
+        instance = Class8.loads(data)
+        self.assertEqual(list(instance.d), [0.5, -2.0, 3.0])
+        self.assertEqual(list(instance.s), [-1, 7])
+        if hasattr(memoryview, 'cast'):
+            self.assertTrue(isinstance(instance.d, memoryview))
+            self.assertTrue(instance.d.obj is data)
+        self.assertEqual(bytes(instance.dumps()), data)
+        self.assertEqual(len(Class8.loads(b'').d), 0)
+        self.assertRaises(Class8.DecodeError, Class8.loads, b'\x12\x03\x00\x00\x00')
+
+    def test_26(self):
+        'length delimited streams'
+        stream = io.BytesIO()
+        for value in (1, 150, -1, 2**20):
+            Class1(value).write_delimited(stream)
+        data = stream.getvalue()
+        self.assertEqual(make_hex(bytearray(data[:4])), '02 08 01 03')
+        result = [item.a for item in Class1.iter_delimited(data)]
+        self.assertEqual(result, [1, 150, -1, 2**20])
+        for size in (1, 3, 1000):
+            stream = io.BytesIO(data)
+            self.assertEqual([item.a for item in
+                Class1.iter_delimited(stream, chunk_size=size)], result)
+        self.assertEqual(list(Class1.iter_delimited(b'')), [])
+        self.assertRaises(Class1.DecodeError,
+            list, Class1.iter_delimited(io.BytesIO(data[:-1])))
+        self.assertRaises(Class1.DecodeError,
+            list, Class1.iter_delimited(data[:-1]))
+        frames = b'\x02\x08\x01' * 100
+        for tail, offset in ((b'\xff' * 10, 300), (b'\x02\x08\xff', 302)):
+            for source in (frames + tail, io.BytesIO(frames + tail)):
+                try:
+                    list(Class1.iter_delimited(source, chunk_size=64))
+                except Class1.DecodeError as error:
+                    self.assertEqual(error.pointer, offset)
+                else:
+                    self.fail('DecodeError not raised')
+
+    def test_27(self):
+        'parallel decoding of delimited files'
+        handle, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                for value in range(1000):
+                    Class1(value).write_delimited(stream)
+            part = parallel.read_range(filename, 3, 9)
+            self.assertFalse(isinstance(part, bytes)) # not copied
+            self.assertEqual(Class1.loads(part, 4, 2).a, 2)
+            result = list(parallel.map_delimited(
+                Class1, filename, collect_values, workers=2, parts=7))
+            self.assertEqual(len(result), 7)
+            self.assertEqual(sum(result, []), list(range(1000)))
+            self.assertEqual(parallel.reduce_delimited(
+                Class1, filename, collect_values, operator.add, [],
+                workers=2), list(range(1000)))
+        finally:
+            os.remove(filename)
+        self.assertEqual(Class1.frame_boundaries(b'', 4), [0])
+        self.assertEqual(Class1.frame_boundaries(b'\x00\x00\x00', 2), [0, 2, 3])
+        self.assertRaises(Class1.DecodeError,
+            Class1.frame_boundaries, b'\x00\x02\x00', 2)
+
+    def test_28(self):
+        'validation and scanning without decoding'
+        data = bytes(Class3(Class3.Class1(150)).dumps())
+        self.assertEqual(Class3.validate(data), None)
+        self.assertEqual(Class3.scan(data), [(3, 2, 3)])
+        self.assertEqual(Class3.Class1.loads(data, 2, 3).a, 150)
+        self.assertEqual(Class4.scan(b'\x22\x01\x03\x20\x05'),
+            [(4, 2, 1), (4, 4, 1)])
+        for bad in (data[:-1], data + b'\x1a', b'', b'\x1a\x00',
+                b'\x1d\x00\x00\x00\x00', b'\x1a\x03\x08\x96\x01\x0c'):
+            self.assertRaises(Class3.DecodeError, Class3.validate, bad)
+        self.assertRaises(ValueError, Class3.validate, data, offset=6)
+
+    def test_29(self):
+        'decoding only requested fields'
+        data = Class5(150, 350).dumps()
+        instance = Class5.loads(data, fields=('b',))
+        self.assertEqual(instance.b, 350)
+        self.assertFalse(instance.HasField('a'))
+        projection = Class3.projection(['c.a'])
+        self.assertEqual(Class3.loads(Class3(Class3.Class1(150)).dumps(),
+            fields=projection).c.a, 150)
+        self.assertRaises(ValueError, Class5.loads, data, fields=('c',))
+        self.assertRaises(ValueError, Class5.loads, data, fields=('a.b',))
+        self.assertRaises(ValueError, Class5.loads, data, fields=projection)
+        instance = Class7.loads(Class7([0.5], [1], [2], [3]).dumps(), fields=['f'])
+        self.assertEqual(list(instance.f), [2])
+        self.assertEqual(len(instance.d), 0)
+
+    def test_30(self):
+        'extracting values by path'
+        data = Class3(Class3.Class1(150)).dumps()
+        self.assertEqual(Class3.extract(data, 'c.a'), 150)
+        self.assertEqual(Class3.extract(data, 'c'), Class3.Class1(150))
+        self.assertEqual(Class3.extract(b'', 'c.a'), None)
+        self.assertEqual(Class4.extract(Class4([3, 270]).dumps(), 'd'), [3, 270])
+        self.assertEqual(Class4.extract(b'', 'd'), [])
+        self.assertRaises(ValueError, Class3.extract, data, 'c.b')
+        self.assertRaises(Class3.DecodeError, Class3.extract, data[:-1], 'c.a')
+
+    def test_31(self):
+        'merging into existing instance'
+        instance = Class5(150, 350)
+        self.assertEqual(instance.MergeFromString(Class5(1, 2).dumps()[:2]), 2)
+        self.assertEqual((instance.a, instance.b), (1, 350))
+        instance = Class4([3])
+        instance.merge(b'\x00' + Class4([270, 5]).dumps(), offset=1)
+        instance.merge(Class4([7]).dumps())
+        self.assertEqual(list(instance.d), [3, 270, 5, 7])
+        instance = Class7([0.5], [1], [2], [3])
+        instance.MergeFromString(Class7([1.5], [], [], [4]).dumps())
+        self.assertEqual(list(instance.d), [0.5, 1.5])
+        self.assertEqual(list(instance.i), [3, 4])
+        inner = Class3.Class1(150)
+        instance = Class3(inner)
+        instance.MergeFromString(Class3(Class3.Class1(7)).dumps())
+        self.assertTrue(instance.c is inner)
+        self.assertEqual(inner.a, 7)
+        instance = Class6.loads(Class6(1, Class6.Body(150)).dumps())
+        instance.MergeFromString(Class6(2, Class6.Body(7)).dumps())
+        self.assertEqual((instance.id, instance.body.a), (2, 7))
+        self.assertRaises(Class6.DecodeError, instance.MergeFromString, b'\x08')
+
+    def test_32(self):
+        'preserving unknown fields'
+        data = Class5(150, 350).dumps()
+        instance = Class1.loads(data)
+        self.assertEqual(instance.a, 150)
+        self.assertEqual(instance.UnknownFields(), data[3:])
+        self.assertEqual(instance.dumps(), data)
+        self.assertEqual(instance.ByteSize(), len(data))
+        instance = Class1.loads(Class5(1, 2).dumps() + Class5(3, 4).dumps())
+        self.assertEqual(instance.UnknownFields(), b'\x10\x02\x10\x04')
+        self.assertEqual(instance.dumps(), b'\x08\x03\x10\x02\x10\x04')
+        instance.MergeFromString(Class5(5, 6).dumps())
+        self.assertEqual(instance.UnknownFields(), b'\x10\x02\x10\x04\x10\x06')
+        for cls in (Class1, Class10):
+            decoded = cls(5)
+            decoded.MergeFromString(b'\x78\x05')
+            copies = [copy.copy(decoded), copy.deepcopy(decoded)]
+            if cls is Class1: # module of extension type is not importable by name
+                copies.append(pickle.loads(pickle.dumps(decoded, 2)))
+            for other in copies:
+                self.assertEqual(other.UnknownFields(), b'\x78\x05')
+                self.assertEqual(other.dumps(), decoded.dumps())
+            other.MergeFromString(b'\x78\x06')
+            self.assertEqual(decoded.UnknownFields(), b'\x78\x05')
+        instance.DiscardUnknownFields()
+        self.assertEqual(instance.dumps(), Class1(5).dumps())
+        self.assertEqual(Class1(150).UnknownFields(), b'')
+
+    def test_33(self):
+        'skipping unknown fields of every wire type'
+        unknown = (b'\x10\x96\x01' + b'\x19' + b'\x00' * 8 + b'\x1a\x02ab'
+            + b'\x23\x28\x05\x2b\x2c\x24' + b'\x2d' + b'\x00' * 4)
+        instance = Class1.loads(b'\x08\x01' + unknown)
+        self.assertEqual(instance.a, 1)
+        self.assertEqual(instance.UnknownFields(), unknown)
+        for data in (b'\x1a\x05ab', b'\x10\x96', b'\x19\x00', b'\x23\x2c', b'\x14'):
+            self.assertRaises(Class1.DecodeError, Class1.loads, b'\x08\x01' + data)
+
+    def test_34(self):
+        'recycling released instances'
+        data = Class9(Class9.Leaf(1), [Class9.Leaf(2)]).dumps()
+        first = Class9.loads(data)
+        leaves = set(map(id, [first.leaf] + first.leaves))
+        first.release()
+        self.assertFalse(hasattr(first, 'leaf'))
+        second = Class9.loads(Class9(Class9.Leaf(3)).dumps())
+        self.assertTrue(second is first)
+        self.assertTrue(id(second.leaf) in leaves)
+        self.assertEqual(second, Class9(Class9.Leaf(3)))
+        instances = [Class9.loads(data) for _ in range(6)]
+        ids = set(map(id, instances))
+        for instance in instances:
+            instance.release()
+        instances = [Class9.loads(data) for _ in range(6)]
+        self.assertEqual(len(ids & set(map(id, instances))), 4)
+        self.assertFalse(hasattr(Class1(1), 'release'))
+        shared = Class9.loads(data)
+        other = Class9(shared.leaf, [shared.leaf])
+        other.release() # consumes shared subtree
+        self.assertFalse(hasattr(shared.leaf, 'a'))
+        shared.release()
+        first, second = Class9.loads(data), Class9.loads(data)
+        leaves = [first.leaf, second.leaf] + first.leaves + second.leaves
+        self.assertEqual(len(set(map(id, leaves))), 4)
+
+    def test_35(self):
+        'messages generated as extension types'
+        instance = Class10(-5, [Class10.Leaf(1)], [2, 3], 0.5, True, u'n', Class10.Leaf(4))
+        data = instance.dumps()
+        decoded = Class10.loads(data)
+        self.assertEqual(type(decoded).__base__.__name__, 'BaseMessageType')
+        self.assertEqual(decoded, instance)
+        self.assertEqual(decoded.dumps(), data)
+        self.assertEqual((decoded.id, decoded.ratio, decoded.flag, decoded.name), (-5, 0.5, True, u'n'))
+        self.assertEqual(decoded.extra.a, 4)
+        self.assertEqual(Class10.Leaf.loads(Class1(7).dumps()).a, 7)
+        empty = Class10(1)
+        self.assertEqual(empty.ratio, 1.5)
+        self.assertFalse(hasattr(empty, 'flag'))
+        self.assertEqual(empty.dumps(), Class10.loads(empty.dumps()).dumps())
+        empty.flag = False
+        self.assertEqual(Class10.loads(empty.dumps()).flag, False)
+        del empty.flag
+        self.assertFalse(empty.HasField('flag'))
+        self.assertRaises(AttributeError, Class10.Leaf.__new__(Class10.Leaf).dumps)
+        self.assertRaises(Class10.DecodeError, Class10.loads, data[:-1])
+
+    def test_36(self):
+        'collecting unpacked repeated fields'
+        leaves = [Class9.Leaf(value) for value in range(100)]
+        self.assertEqual(Class9.loads(Class9(Class9.Leaf(1), leaves).dumps()).leaves, leaves)
+        instance = Class9(Class9.Leaf(1), [Class9.Leaf(2)])
+        instance.MergeFromString(Class9(Class9.Leaf(3), leaves[4:6]).dumps())
+        self.assertEqual([leaf.a for leaf in instance.leaves], [2, 4, 5])
+        self.assertEqual(instance.leaf.a, 3)
+
+    def test_37(self):
+        'immutable messages'
+        for cls in (Class11, Class12):
+            self.assertFalse(hasattr(cls, 'release'))
+        point = Class11.Point(1)
+        instance = Class11(u'a', [point, Class11.Point(2, 4)], [5, 6], point)
+        self.assertRaises(AttributeError, setattr, point, 'x', 2)
+        self.assertRaises(AttributeError, delattr, instance, 'origin')
+        self.assertEqual(point.x, 1)
+        data = instance.dumps()
+        self.assertEqual(instance.dumps(), data)
+        self.assertEqual(instance._encoded_, data)
+        self.assertTrue(point._encoded_ is not None)
+        decoded = Class11.loads(data)
+        self.assertEqual(decoded, instance)
+        self.assertEqual(hash(decoded), hash(instance))
+        self.assertEqual(len(set([decoded, instance, decoded.points[0]])), 2)
+        self.assertEqual(type(decoded.points), tuple)
+        self.assertRaises(AttributeError, decoded.MergeFromString, data)
+        self.assertRaises(AttributeError, setattr, decoded.origin, 'y', 1)
+        self.assertEqual(Class11.loads(decoded.dumps()), instance)
+        other = Class12(7, [u'a', u'b'])
+        self.assertRaises(AttributeError, setattr, other, 'id', 8)
+        self.assertRaises(AttributeError, delattr, other, 'names')
+        self.assertEqual(other.names, (u'a', u'b'))
+        self.assertEqual(Class12.loads(other.dumps()), other)
+        self.assertEqual(hash(Class12.loads(other.dumps())), hash(other))
+        self.assertRaises(AttributeError, Class12.loads(other.dumps()).merge, other.dumps())
+        protocol = protoc.protocol_from_source(inspect.cleandoc('''
+            message Class1 {
+              option immutable = true;
+              repeated int32 values = 1 [packed=true, array=true];
+            }
+            '''))
+        self.assertRaises(ValueError, protocol.data)
+        protocol = protoc.protocol_from_source(inspect.cleandoc('''
+            message Class1 {
+              option immutable = true;
+              repeated int32 values = 1 [packed=true];
+            }
+            message Class2 {
+              option array = true;
+              optional Class1 frozen = 1;
+              repeated int32 values = 2 [packed=true];
+            }
+            '''))
+        self.assertEqual(protocol.data().count('new_array(__array_int32)'), 2)
+
+    def test_38(self):
+        'reusing encoding of unchanged messages'
+        def fresh(message):
+            return type(message).loads(bytes(message.dumps())).dumps()
+        for cls in (Class13, Class14):
+            leaves = [cls.Leaf(value) for value in range(3)]
+            instance = cls(cls.Leaf(7), leaves)
+            data = instance.dumps()
+            self.assertEqual(instance._encoded_, data)
+            self.assertEqual(instance.dumps(), data)
+            leaves[1].a = 10
+            self.assertEqual(instance._encoded_, None)
+            self.assertEqual(instance.leaves[0]._encoded_, bytes(leaves[0].dumps()))
+            self.assertEqual(cls.loads(instance.dumps()).leaves[1].a, 10)
+            instance.leaves.append(cls.Leaf(11))
+            self.assertEqual(cls.loads(instance.dumps()).leaves[-1].a, 11)
+            instance.dumps()
+            del instance.leaves[0]
+            self.assertEqual(len(cls.loads(instance.dumps()).leaves), 3)
+            instance.leaves[1:] = [cls.Leaf(12)]
+            self.assertEqual(len(cls.loads(instance.dumps()).leaves), 2)
+            del instance.leaves[:1]
+            self.assertEqual(cls.loads(instance.dumps()).leaves[0].a, 12)
+            instance.leaves.extend(leaves)
+            decoded = cls.loads(instance.dumps())
+            decoded.dumps()
+            decoded.leaf.a = 8
+            self.assertEqual(cls.loads(decoded.dumps()).leaf.a, 8)
+            other = cls(decoded.leaf, decoded.leaves)
+            other.dumps()
+            decoded.dumps()
+            decoded.leaf.a = 9
+            self.assertEqual(cls.loads(other.dumps()).leaf.a, 9)
+            self.assertEqual(cls.loads(decoded.dumps()).leaf.a, 9)
+            self.assertEqual(decoded.dumps(), fresh(decoded))
+            decoded.MergeFromString(cls(cls.Leaf(1)).dumps())
+            self.assertEqual(cls.loads(decoded.dumps()).leaf.a, 1)
+            self.assertEqual(decoded.dumps(), fresh(decoded))
+            decoded.leaf.__init__(12)
+            self.assertEqual(cls.loads(decoded.dumps()).leaf.a, 12)
+        for cls in (Class13, Class14):
+            decoded = cls.loads(cls(cls.Leaf(1)).dumps() + b'\x78\x05')
+            self.assertTrue(type(decoded._unknown_) is list)
+            self.assertEqual(decoded._encoded_, None)
+            self.assertEqual(decoded.dumps(), cls(cls.Leaf(1)).dumps() + b'\x78\x05')
+        values = [1]
+        leaf = Class13.Leaf(1, values)
+        other = Class14(Class14.Leaf(1), values=values)
+        values.append(2) # assigned lists are copied
+        self.assertEqual((leaf.values, other.values), ([1], [1]))
+        self.assertEqual(Class14.loads(other.dumps()).values, [1])
+        instance = Class13(Class13.Leaf(1, [2]))
+        instance.dumps()
+        instance.leaf.values[0] = 3
+        self.assertEqual(Class13.loads(instance.dumps()).leaf.values, [3])
+        instance.leaf.values += [4]
+        instance.name = u'x'
+        self.assertEqual(Class13.loads(instance.dumps()), Class13(Class13.Leaf(1, [3, 4]), name=u'x'))
+        instance = Class13.loads(instance.dumps() + b'\x20\x01')
+        instance.dumps()
+        instance.DiscardUnknownFields()
+        self.assertEqual(instance.UnknownFields(), b'')
+        self.assertEqual(instance.dumps(), fresh(instance))
+        self.assertEqual(copy.deepcopy(instance), instance)
+        other = Class14(Class14.Leaf(1), values=[1, 2])
+        other.dumps()
+        other.values.extend([3])
+        self.assertEqual(Class14.loads(other.dumps()).values, [1, 2, 3])
+
+    def test_39(self):
+        'presence bitmap of extension types'
+        instance = Class15()
+        self.assertEqual(instance.dumps(), b'')
+        self.assertEqual((instance.f1, instance.f34), (1, 34))
+        self.assertFalse(instance.HasField('f34'))
+        instance.f34 = 34
+        instance.f2 = 0
+        self.assertTrue(instance.HasField('f34'))
+        self.assertFalse(instance.HasField('f33'))
+        decoded = Class15.loads(instance.dumps())
+        self.assertEqual([name for name in ('f1', 'f2', 'f33', 'f34', 'name') if decoded.HasField(name)], ['f2', 'f34'])
+        self.assertEqual((decoded.f2, decoded.f34, decoded.f33), (0, 34, 33))
+        decoded.ClearField('f34')
+        self.assertEqual(decoded.dumps(), Class15(f2=0).dumps())
+        self.assertFalse(decoded.HasField('name'))
+        self.assertRaises(AttributeError, getattr, decoded, 'name')
+        self.assertFalse(decoded.HasField('missing'))
+        empty = Class10(1)
+        empty.ratio = 1.5
+        self.assertTrue(Class10.loads(empty.dumps()).HasField('ratio'))
+        self.assertFalse(Class10.loads(Class10(1).dumps()).HasField('ratio'))
+        explicit = Class15(f1=1)
+        self.assertTrue(explicit.HasField('f1'))
+        self.assertEqual(explicit.dumps(), b'\x08\x01')
+        self.assertTrue(Class15.loads(explicit.dumps()).HasField('f1'))
+
+    def test_40(self):
+        'enumerations'
+        module = sys.modules[Class16.Kind.__module__]
+        Level, Kind = module.Level, Class16.Kind
+        self.assertEqual(list(Level), [module.LOW, module.HIGH])
+        self.assertEqual((Level(2), Level['LOW'], len(Kind)), (module.HIGH, module.LOW, 3))
+        self.assertTrue(Kind.BIG is Kind.LARGE is Class16.LARGE)
+        self.assertEqual((Kind.BIG.name, Kind.BIG.value, Kind.BIG + 1), ('LARGE', 7, 8))
+        self.assertEqual(repr(Kind.SMALL), '<Kind.SMALL: -1>')
+        self.assertRaises(ValueError, Level, 3)
+        self.assertTrue(isinstance(Kind.HUGE, int))
+        instance = Class16(2, [1, 2, 5], [Kind.SMALL, 3, 1000000])
+        decoded = Class16.loads(instance.dumps())
+        self.assertTrue(decoded.level is module.HIGH)
+        self.assertTrue(decoded.kind is Kind.LARGE)
+        self.assertEqual(decoded.levels, [Level.LOW, Level.HIGH, 5])
+        self.assertEqual([type(value) for value in decoded.levels], [Level, Level, int])
+        self.assertEqual([type(value) for value in decoded.kinds], [Kind, int, Kind])
+        self.assertEqual(decoded.dumps(), instance.dumps())
+        self.assertTrue(Class16.loads(Class16(1, kind=Kind.SMALL).dumps()).kind is Kind.SMALL)
+        Class16.validate(instance.dumps())
+        self.assertEqual([span[0] for span in Class16.scan(instance.dumps())], [1, 3, 4, 4, 4])
+
+    def test_41(self):
+        'comparing messages'
+        leaves = [Class9.Leaf(value) for value in range(5)]
+        instance = Class9(Class9.Leaf(1), leaves)
+        self.assertEqual(instance, instance)
+        self.assertEqual(Class9.loads(instance.dumps()), instance)
+        self.assertNotEqual(Class9(Class9.Leaf(1), leaves[:4]), instance)
+        self.assertNotEqual(Class9(Class9.Leaf(1), leaves[:4] + [Class9.Leaf(9)]), instance)
+        self.assertNotEqual(Class9(Class9.Leaf(2), leaves), instance)
+        self.assertNotEqual(instance, None)
+        self.assertNotEqual(Class9.Leaf(1), Class1(1))
+        extension = Class10(1, [Class10.Leaf(2)], [3], extra=Class10.Leaf(4))
+        decoded = Class10.loads(extension.dumps())
+        self.assertEqual(decoded, extension)
+        self.assertEqual(Class10(1), Class10(1, ratio=1.5))
+        self.assertNotEqual(Class10(1), Class10(1, ratio=2.5))
+        self.assertNotEqual(Class10(1), Class10(1, flag=False))
+        self.assertNotEqual(decoded, Class10(1, [Class10.Leaf(2)], [3], extra=Class10.Leaf(5)))
+        self.assertNotEqual(decoded, Class10(1, [Class10.Leaf(2)], [3]))
+        self.assertEqual(Class11(u'a', [Class11.Point(1)]), Class11(u'a', [Class11.Point(1, 3)]))
+        self.assertNotEqual(Class11(u'a', [Class11.Point(1)]), Class11(u'a', [Class11.Point(1, 4)]))
+
+    def test_42(self):
+        'presence bitmap of python classes'
+        Kind = Class16.Kind
+        plain = Class16(1)
+        self.assertFalse(plain.HasField('kind'))
+        self.assertEqual(plain.kind, Kind.LARGE)
+        explicit = Class16(1, kind=Kind.LARGE)
+        self.assertTrue(explicit.HasField('kind'))
+        self.assertNotEqual(explicit.dumps(), plain.dumps())
+        decoded = Class16.loads(explicit.dumps())
+        self.assertTrue(decoded.HasField('kind'))
+        self.assertEqual(decoded.dumps(), explicit.dumps())
+        self.assertEqual(copy.deepcopy(explicit).dumps(), explicit.dumps())
+        self.assertFalse(Class16.loads(plain.dumps()).HasField('kind'))
+        plain.kind = Kind.LARGE
+        self.assertEqual(plain.dumps(), explicit.dumps())
+        del plain.kind
+        self.assertFalse(plain.HasField('kind'))
+        self.assertEqual(plain.dumps(), Class16(1).dumps())
+        decoded.kind = None
+        self.assertEqual((decoded.HasField('kind'), decoded.kind), (False, Kind.LARGE))
+        del decoded.kind
+        self.assertTrue(decoded.HasField('levels'))
@@ -28,6 +28,7 @@ setup(name='protocyt',
         protocyt = [
             'ProtobufGrammar.txt',
             'common.pytempl',
+            'enum.pytempl',
             'file.pytempl',
             'message.pytempl',
             'package.pytempl',